@@ -9,6 +9,7 @@ import prometheus_client
 import re
 import redis
 import socket
+import time
 import tornado.ioloop
 from tornado.routing import Rule, PathMatches, URLSpec
 import tornado.httputil
@@ -37,6 +38,7 @@ from .base import BUCKETS, BaseHandler, Application
 from .download import DownloadId, Download, Metadata
 from .profile import Profile
 from .search import Search
+from .search.join import register_stored_scripts
 from .sessions import SessionNew, SessionGet
 from .upload import Upload
 # from tornado.web import RequestHandler
@@ -298,6 +300,18 @@ class ApiRule(Rule):
 
 def make_app(debug=False):
     es = PrefixedElasticsearch()
+    # Retry a few times, in case the Elasticsearch container is not yet up
+    for i in itertools.count():
+        try:
+            register_stored_scripts(es)
+        except Exception:
+            logger.warning("Can't connect to Elasticsearch, retrying...")
+            if i == 5:
+                raise
+            else:
+                time.sleep(5)
+        else:
+            break
     host, port = os.environ['REDIS_HOST'].split(':')
     port = int(port)
     redis_client = redis.Redis(host=host, port=port)
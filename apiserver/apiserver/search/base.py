@@ -7,14 +7,13 @@ class ClientError(ValueError):
 
 
 def get_column_identifiers(es, column_names, dataset_id=None, data_profile=None):
-    column_indices = [-1 for _ in column_names]
     if not data_profile:
         columns = es.get('datasets', dataset_id, _source='columns.name')
         columns = columns['_source']['columns']
     else:
         columns = data_profile['columns']
-    for i in range(len(columns)):
-        for j in range(len(column_names)):
-            if columns[i]['name'] == column_names[j]:
-                column_indices[j] = i
-    return column_indices
+    name_to_index = {
+        column['name']: i
+        for i, column in enumerate(columns)
+    }
+    return [name_to_index.get(name, -1) for name in column_names]
@@ -1,3 +1,6 @@
+from concurrent.futures import ThreadPoolExecutor
+import elasticsearch
+import heapq
 import logging
 import textwrap
 
@@ -20,6 +23,82 @@ temporal_resolutions_priorities = {
 }
 
 
+COVERAGE_SCRIPT_NUMERICAL = 'datamart_coverage_numerical'
+COVERAGE_SCRIPT_TEMPORAL = 'datamart_coverage_temporal'
+COVERAGE_SCRIPT_SPATIAL = 'datamart_coverage_spatial'
+
+
+COVERAGE_SCRIPT_SOURCES = {
+    COVERAGE_SCRIPT_NUMERICAL: textwrap.dedent('''\
+        double total = 0;
+        for (int i = 0; i < params.ranges.size(); ++i) {
+            double start = Math.max(
+                params.ranges[i][0],
+                doc['coverage.gte'].value
+            );
+            double end = Math.min(
+                params.ranges[i][1],
+                doc['coverage.lte'].value
+            );
+            if (end >= start) {
+                total += end - start + 1;
+            }
+        }
+        return total / params.coverage;
+    '''),
+    COVERAGE_SCRIPT_TEMPORAL: textwrap.dedent('''\
+        double total = 0;
+        for (int i = 0; i < params.ranges.size(); ++i) {
+            double start = Math.max(
+                params.ranges[i][0],
+                doc['ranges.gte'].value
+            );
+            double end = Math.min(
+                params.ranges[i][1],
+                doc['ranges.lte'].value
+            );
+            if (end >= start) {
+                total += end - start + 1;
+            }
+        }
+        return total / params.coverage;
+    '''),
+    COVERAGE_SCRIPT_SPATIAL: textwrap.dedent('''\
+        double total = 0;
+        for (int i = 0; i < params.ranges.size(); ++i) {
+            double n_min_lon = Math.max(doc['ranges.min_lon'].value, params.ranges[i][0][0]);
+            double n_max_lat = Math.min(doc['ranges.max_lat'].value, params.ranges[i][0][1]);
+            double n_max_lon = Math.min(doc['ranges.max_lon'].value, params.ranges[i][1][0]);
+            double n_min_lat = Math.max(doc['ranges.min_lat'].value, params.ranges[i][1][1]);
+            if (n_max_lon >= n_min_lon && n_max_lat >= n_min_lat) {
+                total += (n_max_lon - n_min_lon) * (n_max_lat - n_min_lat);
+            }
+        }
+        return total / params.coverage;
+    '''),
+}
+
+
+def register_stored_scripts(es):
+    """Register the coverage scoring scripts as stored scripts.
+
+    Sending the Painless source inline with every search makes
+    Elasticsearch re-parse it on cache misses; storing the scripts once
+    and referencing them by id avoids the per-request compilation and
+    shrinks the request bodies.
+    """
+    for script_id, source in COVERAGE_SCRIPT_SOURCES.items():
+        es.put_script(
+            id=script_id,
+            body={
+                'script': {
+                    'lang': 'painless',
+                    'source': source,
+                },
+            },
+        )
+
+
 JOIN_RESULT_SOURCE_FIELDS = [
     # General
     'dataset_id', 'name',
@@ -147,13 +226,22 @@ def get_lazo_sketches(data_profile, filter_=None):
     return lazo_sketches
 
 
-def get_numerical_join_search_results(
-    es, type_, type_value, pivot_column, ranges, dataset_id=None, ignore_datasets=None,
+def _build_numerical_join_query(
+    type_, type_value, pivot_column, ranges, dataset_id=None, ignore_datasets=None,
     query_sup_functions=None, query_sup_filters=None,
 ):
-    """Retrieve numerical join search results that intersect with the input numerical ranges.
+    """Build the query body for numerical join search over the 'columns' index.
+
+    Returns ``None`` if there is no valid range to search for.
     """
 
+    # drop empty ranges (bad data); if nothing is left there is no point
+    # querying, and a zero coverage would make the script divide by zero
+    ranges = [range_ for range_ in ranges if range_[1] >= range_[0]]
+    coverage = sum([range_[1] - range_[0] + 1 for range_ in ranges])
+    if not ranges or coverage <= 0:
+        return None
+
     filter_query = []
     must_not_query = []
     if query_sup_filters:
@@ -173,55 +261,46 @@ def get_numerical_join_search_results(
             for id in ignore_datasets
         )
 
-    should_query = list()
-    coverage = sum([range_[1] - range_[0] + 1 for range_ in ranges])
-    for i, range_ in enumerate(ranges):
-        should_query.append({
-            'nested': {
-                'path': 'coverage',
-                'query': {
-                    'function_score': {
-                        'query': {
-                            'range': {
-                                'coverage.range': {
-                                    'gte': range_[0],
-                                    'lte': range_[1],
-                                    'relation': 'intersects'
+    # a single nested clause for all the ranges: one scorer and one script
+    # evaluation per document instead of one per range
+    should_query = [{
+        'nested': {
+            'path': 'coverage',
+            'query': {
+                'script_score': {
+                    'query': {
+                        'bool': {
+                            'should': [
+                                {
+                                    'range': {
+                                        'coverage.range': {
+                                            'gte': range_[0],
+                                            'lte': range_[1],
+                                            'relation': 'intersects'
+                                        }
+                                    }
                                 }
-                            }
-                        },
-                        'script_score': {
-                            'script': {
-                                'lang': 'painless',
-                                'params': {
-                                    'gte': range_[0],
-                                    'lte': range_[1],
-                                    'coverage': coverage
-                                },
-                                'source': textwrap.dedent('''\
-                                    double start = Math.max(
-                                        params.gte,
-                                        doc['coverage.gte'].value
-                                    );
-                                    double end = Math.min(
-                                        params.lte,
-                                        doc['coverage.lte'].value
-                                    );
-                                    return (end - start + 1) / params.coverage;
-                                ''')
-                            }
-                        },
-                        'boost_mode': 'replace'
+                                for range_ in ranges
+                            ],
+                            'minimum_should_match': 1
+                        }
+                    },
+                    'script': {
+                        'id': COVERAGE_SCRIPT_NUMERICAL,
+                        'params': {
+                            'ranges': ranges,
+                            'coverage': coverage
+                        }
                     }
-                },
-                'inner_hits': {
-                    '_source': False,
-                    'size': 100,
-                    'name': 'range-{0}'.format(i)
-                },
-                'score_mode': 'sum'
-            }
-        })
+                }
+            },
+            'inner_hits': {
+                '_source': False,
+                'size': 100
+            },
+            'score_mode': 'sum'
+        }
+    }]
 
     body = {
         '_source': {
@@ -244,6 +323,28 @@ def get_numerical_join_search_results(
         }
     }
 
+    return body
+
+
+def get_numerical_join_search_results(
+    es, type_, type_value, pivot_column, ranges, dataset_id=None, ignore_datasets=None,
+    query_sup_functions=None, query_sup_filters=None,
+):
+    """Retrieve numerical join search results that intersect with the input numerical ranges.
+    """
+
+    body = _build_numerical_join_query(
+        type_,
+        type_value,
+        pivot_column,
+        ranges,
+        dataset_id,
+        ignore_datasets,
+        query_sup_functions,
+        query_sup_filters,
+    )
+    if body is None:
+        return []
     return es.search(
         index='columns',
         body=body,
@@ -252,14 +353,29 @@ def get_numerical_join_search_results(
     )['hits']['hits']
 
 
-def get_spatial_join_search_results(
-    es, ranges, dataset_id=None, ignore_datasets=None,
+def _build_spatial_join_query(
+    ranges, dataset_id=None, ignore_datasets=None,
     query_sup_functions=None, query_sup_filters=None,
 ):
-    """Retrieve spatial join search results that intersect
-    with the input spatial ranges.
+    """Build the query body for spatial join search over the
+    'spatial_coverage' index.
+
+    Returns ``None`` if there is no valid range to search for.
     """
 
+    # drop empty rectangles (bad data); if nothing is left there is no
+    # point querying, and a zero coverage would make the script divide by
+    # zero
+    ranges = [
+        range_ for range_ in ranges
+        if range_[1][0] >= range_[0][0] and range_[0][1] >= range_[1][1]
+    ]
+    coverage = sum([
+        (range_[1][0] - range_[0][0]) * (range_[0][1] - range_[1][1])
+        for range_ in ranges])
+    if not ranges or coverage <= 0:
+        return None
+
     filter_query = []
     must_not_query = []
     if query_sup_filters:
@@ -274,60 +390,58 @@ def get_spatial_join_search_results(
             for id in ignore_datasets
         )
 
-    should_query = list()
-    coverage = sum([
-        (range_[1][0] - range_[0][0]) * (range_[0][1] - range_[1][1])
-        for range_ in ranges])
-    for i, range_ in enumerate(ranges):
-        should_query.append({
-            'nested': {
-                'path': 'ranges',
-                'query': {
-                    'function_score': {
-                        'query': {
-                            'geo_shape': {
-                                'ranges.range': {
-                                    'shape': {
-                                        'type': 'envelope',
-                                        'coordinates': [
-                                            [range_[0][0], range_[0][1]],
-                                            [range_[1][0], range_[1][1]]
+    # a single nested clause for all the ranges: one scorer and one script
+    # evaluation per document instead of one per range
+    should_query = [{
+        'nested': {
+            'path': 'ranges',
+            'query': {
+                'script_score': {
+                    'query': {
+                        'bool': {
+                            # interval-overlap test on the indexed bounds;
+                            # cheaper than intersecting the geo_shape,
+                            # which has to walk the shape trees
+                            'should': [
+                                {
+                                    'bool': {
+                                        'filter': [
+                                            {'range': {'ranges.min_lon': {
+                                                'lte': range_[1][0],
+                                            }}},
+                                            {'range': {'ranges.max_lon': {
+                                                'gte': range_[0][0],
+                                            }}},
+                                            {'range': {'ranges.min_lat': {
+                                                'lte': range_[0][1],
+                                            }}},
+                                            {'range': {'ranges.max_lat': {
+                                                'gte': range_[1][1],
+                                            }}},
                                         ]
-                                    },
-                                    'relation': 'intersects'
+                                    }
                                 }
-                            }
-                        },
-                        'script_score': {
-                            'script': {
-                                'lang': 'painless',
-                                'params': {
-                                    'min_lon': range_[0][0],
-                                    'max_lat': range_[0][1],
-                                    'max_lon': range_[1][0],
-                                    'min_lat': range_[1][1],
-                                    'coverage': coverage
-                                },
-                                'source': textwrap.dedent('''\
-                                    double n_min_lon = Math.max(doc['ranges.min_lon'].value, params.min_lon);
-                                    double n_max_lat = Math.min(doc['ranges.max_lat'].value, params.max_lat);
-                                    double n_max_lon = Math.min(doc['ranges.max_lon'].value, params.max_lon);
-                                    double n_min_lat = Math.max(doc['ranges.min_lat'].value, params.min_lat);
-                                    return ((n_max_lon - n_min_lon) * (n_max_lat - n_min_lat)) / params.coverage;
-                                ''')
-                            }
-                        },
-                        'boost_mode': 'replace'
+                                for range_ in ranges
+                            ],
+                            'minimum_should_match': 1
+                        }
+                    },
+                    'script': {
+                        'id': COVERAGE_SCRIPT_SPATIAL,
+                        'params': {
+                            'ranges': ranges,
+                            'coverage': coverage
+                        }
                     }
-                },
-                'inner_hits': {
-                    '_source': False,
-                    'size': 100,
-                    'name': 'range-{0}'.format(i)
-                },
-                'score_mode': 'sum'
-            }
-        })
+                }
+            },
+            'inner_hits': {
+                '_source': False,
+                'size': 100
+            },
+            'score_mode': 'sum'
+        }
+    }]
 
     body = {
         '_source': {
@@ -350,6 +464,26 @@ def get_spatial_join_search_results(
         }
     }
 
+    return body
+
+
+def get_spatial_join_search_results(
+    es, ranges, dataset_id=None, ignore_datasets=None,
+    query_sup_functions=None, query_sup_filters=None,
+):
+    """Retrieve spatial join search results that intersect
+    with the input spatial ranges.
+    """
+
+    body = _build_spatial_join_query(
+        ranges,
+        dataset_id,
+        ignore_datasets,
+        query_sup_functions,
+        query_sup_filters,
+    )
+    if body is None:
+        return []
     return es.search(
         index='spatial_coverage',
         body=body,
@@ -358,14 +492,23 @@ def get_spatial_join_search_results(
     )['hits']['hits']
 
 
-def get_temporal_join_search_results(
-    es, ranges, dataset_id=None, ignore_datasets=None,
+def _build_temporal_join_query(
+    ranges, dataset_id=None, ignore_datasets=None,
     query_sup_functions=None, query_sup_filters=None,
 ):
-    """Retrieve temporal join search results that intersect
-    with the input temporal ranges.
+    """Build the query body for temporal join search over the
+    'temporal_coverage' index.
+
+    Returns ``None`` if there is no valid range to search for.
     """
 
+    # drop empty ranges (bad data); if nothing is left there is no point
+    # querying, and a zero coverage would make the script divide by zero
+    ranges = [range_ for range_ in ranges if range_[1] >= range_[0]]
+    coverage = sum([range_[1] - range_[0] + 1 for range_ in ranges])
+    if not ranges or coverage <= 0:
+        return None
+
     filter_query = []
     must_not_query = []
     if query_sup_filters:
@@ -380,55 +523,46 @@ def get_temporal_join_search_results(
             for id in ignore_datasets
         )
 
-    should_query = list()
-    coverage = sum([range_[1] - range_[0] + 1 for range_ in ranges])
-    for i, range_ in enumerate(ranges):
-        should_query.append({
-            'nested': {
-                'path': 'ranges',
-                'query': {
-                    'function_score': {
-                        'query': {
-                            'range': {
-                                'ranges.range': {
-                                    'gte': range_[0],
-                                    'lte': range_[1],
-                                    'relation': 'intersects'
+    # a single nested clause for all the ranges: one scorer and one script
+    # evaluation per document instead of one per range
+    should_query = [{
+        'nested': {
+            'path': 'ranges',
+            'query': {
+                'script_score': {
+                    'query': {
+                        'bool': {
+                            'should': [
+                                {
+                                    'range': {
+                                        'ranges.range': {
+                                            'gte': range_[0],
+                                            'lte': range_[1],
+                                            'relation': 'intersects'
+                                        }
+                                    }
                                 }
-                            }
-                        },
-                        'script_score': {
-                            'script': {
-                                'lang': 'painless',
-                                'params': {
-                                    'gte': range_[0],
-                                    'lte': range_[1],
-                                    'coverage': coverage
-                                },
-                                'source': textwrap.dedent('''\
-                                    double start = Math.max(
-                                        params.gte,
-                                        doc['ranges.gte'].value
-                                    );
-                                    double end = Math.min(
-                                        params.lte,
-                                        doc['ranges.lte'].value
-                                    );
-                                    return (end - start + 1) / params.coverage;
-                                ''')
-                            }
-                        },
-                        'boost_mode': 'replace'
+                                for range_ in ranges
+                            ],
+                            'minimum_should_match': 1
+                        }
+                    },
+                    'script': {
+                        'id': COVERAGE_SCRIPT_TEMPORAL,
+                        'params': {
+                            'ranges': ranges,
+                            'coverage': coverage
+                        }
                     }
-                },
-                'inner_hits': {
-                    '_source': False,
-                    'size': 100,
-                    'name': 'range-{0}'.format(i)
-                },
-                'score_mode': 'sum'
-            }
-        })
+                }
+            },
+            'inner_hits': {
+                '_source': False,
+                'size': 100
+            },
+            'score_mode': 'sum'
+        }
+    }]
 
     body = {
         '_source': {
@@ -451,6 +585,26 @@ def get_temporal_join_search_results(
         }
     }
 
+    return body
+
+
+def get_temporal_join_search_results(
+    es, ranges, dataset_id=None, ignore_datasets=None,
+    query_sup_functions=None, query_sup_filters=None,
+):
+    """Retrieve temporal join search results that intersect
+    with the input temporal ranges.
+    """
+
+    body = _build_temporal_join_query(
+        ranges,
+        dataset_id,
+        ignore_datasets,
+        query_sup_functions,
+        query_sup_filters,
+    )
+    if body is None:
+        return []
     return es.search(
         index='temporal_coverage',
         body=body,
@@ -459,47 +613,14 @@ def get_temporal_join_search_results(
     )['hits']['hits']
 
 
-def get_textual_join_search_results(
-    es, query_results,
+def _build_textual_join_query(
+    query_results,
     query_sup_functions=None, query_sup_filters=None,
 ):
-    """Combine Lazo textual search results with Elasticsearch
-    (keyword search).
+    """Build the query body for textual join search over the
+    'columns' index (keyword search).
     """
 
-    scores_per_dataset = dict()
-    column_per_dataset = dict()
-    for d_id, name, lazo_score in query_results:
-        if d_id not in column_per_dataset:
-            column_per_dataset[d_id] = list()
-            scores_per_dataset[d_id] = dict()
-        column_per_dataset[d_id].append(name)
-        scores_per_dataset[d_id][name] = lazo_score
-
-    # if there is no keyword query
-    if not (query_sup_functions or query_sup_filters):
-        results = list()
-        for dataset_id in column_per_dataset:
-            column_indices = get_column_identifiers(
-                es=es,
-                column_names=column_per_dataset[dataset_id],
-                dataset_id=dataset_id
-            )
-            for j in range(len(column_indices)):
-                column_name = column_per_dataset[dataset_id][j]
-                results.append(
-                    dict(
-                        _score=scores_per_dataset[dataset_id][column_name],
-                        _source=dict(
-                            dataset_id=dataset_id,
-                            name=column_name,
-                            index=column_indices[j]
-                        )
-                    )
-                )
-        return results
-
-    # if there is a keyword query
     should_query = list()
     for d_id, name, lazo_score in query_results:
         should_query.append(
@@ -507,7 +628,7 @@ def get_textual_join_search_results(
                 'constant_score': {
                     'filter': {
                         'bool': {
-                            'must': [
+                            'filter': [
                                 {
                                     'term': {
                                         'dataset_id': d_id
@@ -546,9 +667,57 @@ def get_textual_join_search_results(
         }
     }
 
+    return body
+
+
+def get_textual_join_search_results(
+    es, query_results,
+    query_sup_functions=None, query_sup_filters=None,
+):
+    """Combine Lazo textual search results with Elasticsearch
+    (keyword search).
+    """
+
+    scores_per_dataset = dict()
+    column_per_dataset = dict()
+    for d_id, name, lazo_score in query_results:
+        if d_id not in column_per_dataset:
+            column_per_dataset[d_id] = list()
+            scores_per_dataset[d_id] = dict()
+        column_per_dataset[d_id].append(name)
+        scores_per_dataset[d_id][name] = lazo_score
+
+    # if there is no keyword query
+    if not (query_sup_functions or query_sup_filters):
+        results = list()
+        for dataset_id in column_per_dataset:
+            column_indices = get_column_identifiers(
+                es=es,
+                column_names=column_per_dataset[dataset_id],
+                dataset_id=dataset_id
+            )
+            for j in range(len(column_indices)):
+                column_name = column_per_dataset[dataset_id][j]
+                results.append(
+                    dict(
+                        _score=scores_per_dataset[dataset_id][column_name],
+                        _source=dict(
+                            dataset_id=dataset_id,
+                            name=column_name,
+                            index=column_indices[j]
+                        )
+                    )
+                )
+        return results
+
+    # if there is a keyword query
     return es.search(
         index='columns',
-        body=body,
+        body=_build_textual_join_query(
+            query_results,
+            query_sup_functions,
+            query_sup_filters,
+        ),
         size=TOP_K_SIZE,
         request_timeout=30,
     )['hits']['hits']
@@ -578,43 +747,54 @@ def get_joinable_datasets(
         tabular_variables,
     )
 
+    # column names are looked up repeatedly below, build the index-to-name
+    # mapping once
+    column_names = [column['name'] for column in data_profile['columns']]
+
     # search results
     search_results = list()
 
+    # per-column queries, batched in a single msearch request below
+    searches = list()  # [(column, temporal_resolution, index, body)]
+
     # numerical, temporal, and spatial attributes
     for column, coverage in column_coverage.items():
         type_ = coverage['type']
         type_value = coverage.get('type_value')
         if type_ == 'spatial':
             if 'ranges' in coverage:
-                spatial_results = get_spatial_join_search_results(
-                    es,
+                body = _build_spatial_join_query(
                     coverage['ranges'],
                     dataset_id,
                     ignore_datasets,
                     query_sup_functions,
                     query_sup_filters,
                 )
-                for result in spatial_results:
-                    result['companion_column'] = column
-                    search_results.append(result)
+                if body is not None:
+                    searches.append((
+                        column,
+                        None,
+                        'spatial_coverage',
+                        body,
+                    ))
         elif type_ == 'temporal':
-            temporal_results = get_temporal_join_search_results(
-                es,
+            body = _build_temporal_join_query(
                 coverage['ranges'],
                 dataset_id,
                 ignore_datasets,
                 query_sup_functions,
                 query_sup_filters,
             )
-            for result in temporal_results:
-                result['companion_column'] = column
-                result['companion_temporal_resolution'] = coverage['temporal_resolution']
-                search_results.append(result)
+            if body is not None:
+                searches.append((
+                    column,
+                    coverage['temporal_resolution'],
+                    'temporal_coverage',
+                    body,
+                ))
         elif len(column) == 1:
-            column_name = data_profile['columns'][column[0]]['name']
-            numerical_results = get_numerical_join_search_results(
-                es,
+            column_name = column_names[column[0]]
+            body = _build_numerical_join_query(
                 type_,
                 type_value,
                 column_name,
@@ -624,9 +804,13 @@ def get_joinable_datasets(
                 query_sup_functions,
                 query_sup_filters,
             )
-            for result in numerical_results:
-                result['companion_column'] = column
-                search_results.append(result)
+            if body is not None:
+                searches.append((
+                    column,
+                    None,
+                    'columns',
+                    body,
+                ))
         else:
             raise ValueError("Unknown coverage from multiple columns?")
 
@@ -635,12 +819,19 @@ def get_joinable_datasets(
         data_profile,
         tabular_variables,
     )
-    for column, (n_permutations, hash_values, cardinality) in lazo_sketches.items():
-        query_results = lazo_client.query_lazo_sketch_data(
-            n_permutations,
-            hash_values,
-            cardinality
-        )
+    if lazo_sketches:
+        # the sketch queries are independent network calls, issue them
+        # concurrently
+        with ThreadPoolExecutor(
+            max_workers=min(len(lazo_sketches), 8),
+        ) as executor:
+            lazo_results = list(executor.map(
+                lambda sketch: lazo_client.query_lazo_sketch_data(*sketch),
+                lazo_sketches.values(),
+            ))
+    else:
+        lazo_results = []
+    for column, query_results in zip(lazo_sketches, lazo_results):
         if dataset_id:
             query_results = [
                 res for res in query_results if res[0] == dataset_id
@@ -651,26 +842,80 @@ def get_joinable_datasets(
             ]
         if not query_results:
             continue
-        textual_results = get_textual_join_search_results(
-            es,
-            query_results[:MAX_LAZO_CANDIDATES_SIZE],
-            query_sup_functions,
-            query_sup_filters,
-        )
-        for result in textual_results:
-            result['companion_column'] = column
-            search_results.append(result)
+        if not (query_sup_functions or query_sup_filters):
+            # no keyword query, results are built from the Lazo scores alone
+            textual_results = get_textual_join_search_results(
+                es,
+                query_results[:MAX_LAZO_CANDIDATES_SIZE],
+                query_sup_functions,
+                query_sup_filters,
+            )
+            for result in textual_results:
+                result['companion_column'] = column
+                search_results.append(result)
+        else:
+            searches.append((
+                column,
+                None,
+                'columns',
+                _build_textual_join_query(
+                    query_results[:MAX_LAZO_CANDIDATES_SIZE],
+                    query_sup_functions,
+                    query_sup_filters,
+                ),
+            ))
 
-    search_results = sorted(
+    # run all the per-column queries in a single round-trip
+    if searches:
+        responses = es.msearch(
+            [
+                ({'index': index}, dict(body, size=TOP_K_SIZE))
+                for _, _, index, body in searches
+            ],
+            request_timeout=30,
+        )['responses']
+        for (column, temporal_resolution, _, _), response in \
+                zip(searches, responses):
+            if 'error' in response:
+                # msearch reports failures per sub-search instead of
+                # failing the request; surface them like es.search would
+                error = response['error']
+                raise elasticsearch.TransportError(
+                    response.get('status', 500),
+                    error.get('type', 'search_phase_execution_exception'),
+                    error,
+                )
+            for result in response['hits']['hits']:
+                result['companion_column'] = column
+                if temporal_resolution is not None:
+                    result['companion_temporal_resolution'] = \
+                        temporal_resolution
+                search_results.append(result)
+
+    # only the top results are kept in the end, no need to sort the whole
+    # list
+    search_results = heapq.nlargest(
+        TOP_K_SIZE,
         search_results,
         key=lambda item: item['_score'],
-        reverse=True
     )
 
+    # fetch metadata for all the matching datasets in one request
+    dataset_ids = list({
+        result['_source']['dataset_id'] for result in search_results
+    })
+    meta_by_id = {}
+    if dataset_ids:
+        meta_by_id = {
+            doc['_id']: doc['_source']
+            for doc in es.mget('datasets', dataset_ids)['docs']
+            if doc.get('found')
+        }
+
     results = []
     for result in search_results:
         dt = result['_source']['dataset_id']
-        meta = es.get('datasets', dt)['_source']
+        meta = meta_by_id[dt]
         left_columns = []
         right_columns = []
         left_columns_names = []
@@ -680,7 +925,7 @@ def get_joinable_datasets(
 
         left_columns.append(list(result['companion_column']))
         left_columns_names.append([
-            data_profile['columns'][comp]['name']
+            column_names[comp]
             for comp in result['companion_column']
         ])
 
@@ -1,7 +1,8 @@
 from collections import Counter
+import heapq
 import logging
 
-from .base import get_column_identifiers
+from .base import TOP_K_SIZE
 
 
 logger = logging.getLogger(__name__)
@@ -78,28 +79,53 @@ def get_unionable_datasets(es, data_profile, dataset_id=None, ignore_datasets=No
     for type_ in main_dataset_columns:
         n_columns += len(main_dataset_columns[type_])
 
+    # the same (attribute, column name) pairs come back for many hits, so
+    # cache the similarities instead of re-computing the n-grams each time
+    sim_cache = dict()
+
     column_pairs = dict()
     for type_ in main_dataset_columns:
         for att in main_dataset_columns[type_]:
-            partial_query = {
-                'should': [
-                    {
-                        'term': {'columns.structural_type': type_}
-                    },
-                    {
-                        'term': {'columns.semantic_types': type_}
-                    },
-                ],
-                'must': [
-                    {
-                        'fuzzy': {'columns.name.raw': att}
-                    }
-                ],
-                'minimum_should_match': 1
-            }
+            type_query = [
+                {
+                    'term': {'columns.structural_type': type_}
+                },
+                {
+                    'term': {'columns.semantic_types': type_}
+                },
+            ]
+            if query_args_main:
+                partial_query = {
+                    'should': type_query,
+                    'must': [
+                        {
+                            'fuzzy': {'columns.name.raw': att}
+                        }
+                    ],
+                    'minimum_should_match': 1
+                }
+                occurrence = 'must'
+            else:
+                # the ES score is not used in this branch (es_score is set
+                # to 1 below), so run the clauses in filter context:
+                # scoring is skipped and the filters can be cached
+                partial_query = {
+                    'filter': [
+                        {
+                            'bool': {
+                                'should': type_query,
+                                'minimum_should_match': 1
+                            }
+                        },
+                        {
+                            'fuzzy': {'columns.name.raw': att}
+                        },
+                    ]
+                }
+                occurrence = 'filter'
 
             if dataset_id:
-                partial_query['must'].append(
+                partial_query[occurrence].append(
                     {'term': {'_id': dataset_id}}
                 )
             if ignore_datasets:
@@ -128,6 +154,14 @@ def get_unionable_datasets(es, data_profile, dataset_id=None, ignore_datasets=No
                         'columns.name',
                     ],
                 },
+                # sort with an _id tiebreaker so search_after can resume
+                # from the last hit; from_/size pagination re-evaluates the
+                # top from_+size hits on every page
+                'sort': [
+                    {'_score': 'desc'},
+                    {'_id': 'asc'},
+                ],
+                'track_total_hits': False,
                 'query': {
                     'bool': {
                         'must': args,
@@ -135,17 +169,13 @@ def get_unionable_datasets(es, data_profile, dataset_id=None, ignore_datasets=No
                 }
             }
 
-            # FIXME: Use search-after API here?
-            from_ = 0
             while True:
                 hits = es.search(
                     index='datasets',
                     body=query_obj,
-                    from_=from_,
                     size=PAGINATION_SIZE,
                     request_timeout=30
                 )['hits']['hits']
-                from_ += len(hits)
 
                 for hit in hits:
 
@@ -160,70 +190,108 @@ def get_unionable_datasets(es, data_profile, dataset_id=None, ignore_datasets=No
                     for column_hit in inner_hits['columns']['hits']['hits']:
                         column_offset = int(column_hit['_nested']['offset'])
                         column_name = columns[column_offset]['name']
-                        sim = name_similarity(att.lower(), column_name.lower())
+                        try:
+                            sim = sim_cache[att, column_name]
+                        except KeyError:
+                            sim = name_similarity(
+                                att.lower(),
+                                column_name.lower(),
+                            )
+                            sim_cache[att, column_name] = sim
                         column_pairs[dataset_name].append((att, column_name, sim, es_score))
 
                 if len(hits) != PAGINATION_SIZE:
                     break
+                query_obj['search_after'] = hits[-1]['sort']
 
     scores = dict()
     for dataset in list(column_pairs.keys()):
 
-        # choose pairs with higher similarity
+        # choose pairs with higher similarity, computing the score in the
+        # same pass; popping from a heap avoids a full sort of the
+        # candidates
+        candidates = [
+            (-sim, att_1, att_2, es_score)
+            for att_1, att_2, sim, es_score in column_pairs[dataset]
+        ]
+        heapq.heapify(candidates)
         seen_1 = set()
         seen_2 = set()
         pairs = []
-        for att_1, att_2, sim, es_score in sorted(column_pairs[dataset],
-                                                  key=lambda item: item[2],
-                                                  reverse=True):
+        sum_similarity = 0
+        max_es_score = 0
+        while candidates:
+            neg_sim, att_1, att_2, es_score = heapq.heappop(candidates)
             if att_1 in seen_1 or att_2 in seen_2:
                 continue
             seen_1.add(att_1)
             seen_2.add(att_2)
-            pairs.append((att_1, att_2, sim, es_score))
+            pairs.append((att_1, att_2, -neg_sim, es_score))
+            sum_similarity += -neg_sim
+            max_es_score = max(max_es_score, es_score)
 
         if len(pairs) <= 1:
             del column_pairs[dataset]
             continue
 
         column_pairs[dataset] = pairs
-        scores[dataset] = 0
-        es_score = 0
-
-        for pair in column_pairs[dataset]:
-            sim = pair[2]
-            scores[dataset] += sim
-            es_score = max(es_score, pair[3])
+        scores[dataset] = (sum_similarity / n_columns) * max_es_score
 
-        scores[dataset] = (scores[dataset] / n_columns) * es_score
-
-    sorted_datasets = sorted(
+    # only the top results are kept in the end, no need to sort the whole
+    # list
+    sorted_datasets = heapq.nlargest(
+        TOP_K_SIZE,
         scores.items(),
         key=lambda item: item[1],
-        reverse=True
     )
 
+    # fetch metadata for all the matching datasets in one request
+    meta_by_id = {}
+    if sorted_datasets:
+        meta_by_id = {
+            doc['_id']: doc['_source']
+            for doc in es.mget(
+                'datasets',
+                [dt for dt, _ in sorted_datasets],
+            )['docs']
+            if doc.get('found')
+        }
+
+    # resolve column identifiers locally, from the input profile on the
+    # left and the metadata fetched above on the right, instead of one ES
+    # request per column pair
+    if dataset_id:
+        left_column_index = {
+            column['name']: i
+            for i, column in enumerate(
+                es.get(
+                    'datasets', dataset_id,
+                    _source='columns.name',
+                )['_source']['columns']
+            )
+        }
+    else:
+        left_column_index = {
+            column['name']: i
+            for i, column in enumerate(data_profile['columns'])
+        }
+
     results = []
     for dt, score in sorted_datasets:
-        meta = es.get('datasets', dt)['_source']
+        meta = meta_by_id[dt]
+        right_column_index = {
+            column['name']: i
+            for i, column in enumerate(meta['columns'])
+        }
         # TODO: augmentation information is incorrect
         left_columns = []
         right_columns = []
         left_columns_names = []
         right_columns_names = []
         for att_1, att_2, sim, es_score in column_pairs[dt]:
-            if dataset_id:
-                left_columns.append(
-                    get_column_identifiers(es, [att_1], dataset_id=dataset_id)
-                )
-            else:
-                left_columns.append(
-                    get_column_identifiers(es, [att_1], data_profile=data_profile)
-                )
+            left_columns.append([left_column_index.get(att_1, -1)])
             left_columns_names.append([att_1])
-            right_columns.append(
-                get_column_identifiers(es, [att_2], dataset_id=dt)
-            )
+            right_columns.append([right_column_index.get(att_2, -1)])
             right_columns_names.append([att_2])
         results.append(dict(
             id=dt,
@@ -13,6 +13,11 @@ import sentry_sdk
 import sys
 import threading
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from . import types
 
 
@@ -167,12 +172,20 @@ def block_run(loop, coro):
     return block_wait_future(future)
 
 
-def json2msg(obj, **kwargs):
-    return aio_pika.Message(json.dumps(obj).encode('utf-8'), **kwargs)
+if orjson is not None:
+    # orjson serializes straight to bytes in native code, which matters on
+    # paths that publish one message per dataset
+    def json2msg(obj, **kwargs):
+        return aio_pika.Message(orjson.dumps(obj), **kwargs)
 
+    def msg2json(msg):
+        return orjson.loads(msg.body)
+else:
+    def json2msg(obj, **kwargs):
+        return aio_pika.Message(json.dumps(obj).encode('utf-8'), **kwargs)
 
-def msg2json(msg):
-    return json.loads(msg.body.decode('utf-8'))
+    def msg2json(msg):
+        return json.loads(msg.body.decode('utf-8'))
 
 
 _log_future_references = {}
@@ -201,9 +214,12 @@ def log_future(future, logger, message="Exception in background task",
 
 
 class PrefixedElasticsearch(object):
-    def __init__(self):
+    def __init__(self, **kwargs):
+        # extra keyword arguments (maxsize, http_compress, timeout, ...) are
+        # passed through to the underlying client
         self.es = elasticsearch.Elasticsearch(
-            os.environ['ELASTICSEARCH_HOSTS'].split(',')
+            os.environ['ELASTICSEARCH_HOSTS'].split(','),
+            **kwargs
         )
         self.prefix = os.environ['ELASTICSEARCH_PREFIX']
 
@@ -213,6 +229,13 @@ class PrefixedElasticsearch(object):
     def get(self, index, id, _source=None):
         return self.es.get(self.add_prefix(index), id, _source=_source)
 
+    def mget(self, index, ids, _source=None):
+        return self.es.mget(
+            index=self.add_prefix(index),
+            body={'ids': list(ids)},
+            _source=_source,
+        )
+
     def index(self, index, body, id=None):
         return self.es.index(index=self.add_prefix(index), body=body, id=id)
 
@@ -223,6 +246,20 @@ class PrefixedElasticsearch(object):
             body=body, size=size, from_=from_, request_timeout=request_timeout,
         )
 
+    def msearch(self, searches, request_timeout=None):
+        """Run multiple searches in a single request.
+
+        :param searches: list of ``(header, body)`` pairs, where the header
+            carries the (un-prefixed) index name.
+        """
+        body = []
+        for header, query in searches:
+            if 'index' in header:
+                header = dict(header, index=self.add_prefix(header['index']))
+            body.append(header)
+            body.append(query)
+        return self.es.msearch(body=body, request_timeout=request_timeout)
+
     def delete(self, index, id):
         return self.es.delete(self.add_prefix(index), id)
 
@@ -235,6 +272,12 @@ class PrefixedElasticsearch(object):
     def index_create(self, index, body=None):
         return self.es.indices.create(self.add_prefix(index), body=body)
 
+    def put_script(self, id, body):
+        # stored scripts are cluster-global, not index-scoped, so the
+        # prefix does not apply; the sources are the same for every
+        # deployment anyway
+        return self.es.put_script(id=id, body=body)
+
     def scan(self, index, query, **kwargs):
         return elasticsearch.helpers.scan(
             self.es,
@@ -480,6 +523,8 @@ def add_dataset_to_lazo_storage(es, id, metadata):
 
 def delete_dataset_from_lazo(es, dataset_id, lazo_client):
     query = {
+        # only the column name is read from the hits
+        '_source': ['name'],
         'query': {
             'bool': {
                 'must': [
@@ -493,20 +538,14 @@ def delete_dataset_from_lazo(es, dataset_id, lazo_client):
         }
     }
     textual_columns = list()
-    # FIXME: Use search-after API here?
-    from_ = 0
-    while True:
-        hits = es.search(
-            index='columns',
-            body=query,
-            from_=from_,
-            size=10000,
-        )['hits']['hits']
-        from_ += len(hits)
-        for h in hits:
-            textual_columns.append(h['_source']['name'])
-        if len(hits) != 10000:
-            break
+    # Use the scroll API, deep from_/size pagination re-evaluates the top
+    # from_+size hits on every page
+    for h in es.scan(
+        index='columns',
+        query=query,
+        size=10000,
+    ):
+        textual_columns.append(h['_source']['name'])
 
     if textual_columns:
         ack = lazo_client.remove_sketches(dataset_id, textual_columns)
@@ -9,6 +9,7 @@ req = [
     'aio-pika',
     'elasticsearch~=7.0',
     'lazo-index-service==0.7.0',
+    'orjson>=3.6,<4',
     's3fs',
     'gcsfs',
     'advocate>=1.0,<2',
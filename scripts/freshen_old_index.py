@@ -10,52 +10,227 @@ older than a specified commit.
 
 import aio_pika
 import asyncio
+import json
 import logging
 import os
+import shelve
 import subprocess
 import sys
 
-from datamart_core.common import PrefixedElasticsearch, json2msg
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_scan
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
 
 
 logger = logging.getLogger(__name__)
 
 
+if orjson is not None:
+    # serializes to bytes in native code, one call per message saved too
+    dumps = orjson.dumps
+else:
+    def dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+
 SIZE = 10000
 
+PUBLISH_BATCH_SIZE = 64
+
+AMQP_CHANNELS = 8
+
+# optional metadata fields forwarded to the profiler when set
+OPTIONAL_METADATA_KEYS = ('description', 'date', 'manual_annotations')
+
+
+# this script gets run repeatedly against the same few reference commits,
+# so the ancestry answers are also kept on disk across invocations
+MERGEBASE_CACHE = os.path.expanduser('~/.cache/datamart/mergebase.db')
 
 _more_recent_cache = {}
 
+_repo = None
+
+_disk_cache = None
+
+
+def get_repo():
+    global _repo
+    if _repo is None:
+        _repo = pygit2.Repository('.')
+    return _repo
+
+
+def get_disk_cache():
+    global _disk_cache
+    if _disk_cache is None:
+        os.makedirs(os.path.dirname(MERGEBASE_CACHE), exist_ok=True)
+        _disk_cache = shelve.open(MERGEBASE_CACHE)
+    return _disk_cache
+
+
+def close_disk_cache():
+    # flush the dbm buffers to disk; without this the answers computed
+    # this run might never persist
+    global _disk_cache
+    if _disk_cache is not None:
+        _disk_cache.close()
+        _disk_cache = None
+
 
 def is_version_more_recent(old, new):
+    """Whether ``new`` is at least as recent a commit as ``old``.
+
+    ``old`` is the reference version, already resolved to a full commit
+    hash by the caller, so only ``new`` needs to go through git.
+    """
     cache = _more_recent_cache.setdefault(old, {})
     if new in cache:
         return cache[new]
+    if pygit2 is not None:
+        # in-process: the object database is opened once, no fork and no
+        # pack index re-load per query
+        repo = get_repo()
+        old_oid = pygit2.Oid(hex=old)
+        try:
+            new_oid = repo.revparse_single('%s^{commit}' % new).id
+        except (KeyError, ValueError):
+            # a version recorded in the index that this checkout can't
+            # resolve (garbage value, shallow clone, rewritten history):
+            # treat it as stale so the dataset just gets reprocessed; not
+            # written to the disk cache, a deeper clone may resolve it
+            logger.warning("Can't resolve version %r, will reprocess", new)
+            cache[new] = False
+            return False
+        # key by resolved commits, so a moving ref can't make a stale
+        # answer stick
+        disk_cache = get_disk_cache()
+        key = '%s:%s' % (old_oid, new_oid)
+        if key in disk_cache:
+            more_recent = disk_cache[key]
+        else:
+            # we only need to know whether old is an ancestor of new, not
+            # the actual merge base; the reachability test uses
+            # commit-graph generation numbers and returns as soon as it is
+            # decided
+            more_recent = (
+                old_oid == new_oid or repo.descendant_of(new_oid, old_oid)
+            )
+            disk_cache[key] = more_recent
+        logger.debug("%s %s %s", old, ['>', '<='][more_recent], new)
     else:
-        more_recent = subprocess.call(
-            (
-                '[ "$(git merge-base {0} {1})" = ' +
-                '"$(git rev-parse {0}^{{commit}})" ]'
-            ).format(
-                old, new,
-            ),
-            shell=True,
-        )
-        if more_recent not in (0, 1):
-            raise subprocess.CalledProcessError(more_recent, 'git')
-        logger.debug("%s %s %s", old, ['<=', '>'][more_recent], new)
-        more_recent = more_recent == 0
-        cache[new] = more_recent
-        return more_recent
+        # resolving the names first would cost the forks we are trying to
+        # save; the versions recorded in the index are immutable commit
+        # identifiers in practice, so they make a stable key as-is
+        disk_cache = get_disk_cache()
+        key = '%s:%s' % (old, new)
+        if key in disk_cache:
+            more_recent = disk_cache[key]
+        else:
+            # one git process instead of a shell spawning two; the exit
+            # code encodes the answer directly
+            ret = subprocess.call(
+                ['git', 'merge-base', '--is-ancestor', old, new],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            if ret not in (0, 1):
+                # git exits 128 when it can't resolve the version; treat
+                # it as stale so the dataset just gets reprocessed, like
+                # the pygit2 path above
+                logger.warning("Can't resolve version %r, will reprocess",
+                               new)
+                cache[new] = False
+                return False
+            more_recent = ret == 0
+            disk_cache[key] = more_recent
+        logger.debug("%s %s %s", old, ['>', '<='][more_recent], new)
+    cache[new] = more_recent
+    return more_recent
+
+
+async def scan_pages(hits, queue):
+    """Feed pages of hits from the asynchronous scroll into a queue.
+
+    The bounded queue lets the next page be fetched while the previous one
+    is being published, without buffering the whole index.
+    """
+    try:
+        page = []
+        async for h in hits:
+            page.append(h)
+            if len(page) >= SIZE:
+                await queue.put(page)
+                page = []
+        if page:
+            await queue.put(page)
+    finally:
+        # always deliver the sentinel, even if the scroll fails: the
+        # consumer then drops out of its loop and awaiting this task
+        # surfaces the exception, instead of hanging on the queue
+        await queue.put(None)
 
 
 async def freshen(version):
-    # Check that it's a valid version
-    version_hash = subprocess.check_output(['git', 'rev-parse', version])
+    # Check that it's a valid version; the resolved hash is what gets
+    # compared against below, so the reference side is never re-resolved
+    version_hash = subprocess.check_output(
+        ['git', 'rev-parse', '%s^{commit}' % version],
+    )
     version_hash = version_hash.decode('ascii').strip()
     logger.warning("Reprocessing datasets profiled before %s", version_hash)
 
-    es = PrefixedElasticsearch()
+    # the rest of this coroutine is async, so use the async client: scroll
+    # fetches then cooperate with the event loop instead of stalling the
+    # in-flight publishes; a larger connection pool avoids head-of-line
+    # blocking, and gzip on the wire pays off on the highly compressible
+    # metadata documents
+    prefix = os.environ['ELASTICSEARCH_PREFIX']
+    es = AsyncElasticsearch(
+        os.environ['ELASTICSEARCH_HOSTS'].split(','),
+        maxsize=32,
+        http_compress=True,
+        timeout=60,
+        retry_on_timeout=True,
+    )
+    try:
+        await _freshen(es, prefix + 'datasets', version_hash)
+    finally:
+        close_disk_cache()
+        await es.close()
+
+
+async def _freshen(es, index, version):
+    # there are only a handful of distinct profiler versions across the
+    # index; classify each of them once up front instead of consulting
+    # git in the loop
+    buckets = (await es.search(
+        index=index,
+        body={
+            'size': 0,
+            'aggs': {
+                'versions': {
+                    'terms': {
+                        'field': 'version',
+                        'size': 1000,
+                    },
+                },
+            },
+        },
+    ))['aggregations']['versions']['buckets']
+    recent_versions = {
+        bucket['key'] for bucket in buckets
+        if is_version_more_recent(version, bucket['key'])
+    }
 
     amqp_conn = await aio_pika.connect_robust(
         host=os.environ['AMQP_HOST'],
@@ -63,46 +238,101 @@ async def freshen(version):
         login=os.environ['AMQP_USER'],
         password=os.environ['AMQP_PASSWORD'],
     )
-    amqp_chan = await amqp_conn.channel()
-    amqp_profile_exchange = await amqp_chan.declare_exchange(
-        'profile',
-        aio_pika.ExchangeType.FANOUT,
-    )
+    try:
+        # a pool of channels, so concurrent publishes don't all serialize on a
+        # single channel's lock; confirms are off since re-enqueueing profile
+        # jobs is idempotent, so losing one to a crash is acceptable here
+        amqp_exchanges = []
+        for _ in range(AMQP_CHANNELS):
+            amqp_chan = await amqp_conn.channel(publisher_confirms=False)
+            amqp_exchanges.append(await amqp_chan.declare_exchange(
+                'profile',
+                aio_pika.ExchangeType.FANOUT,
+            ))
 
-    hits = es.scan(
-        index='datasets',
-        query={
-            'query': {
-                'match_all': {},
+        # filter on the server side, so datasets that are already up to date
+        # don't get shipped over the wire at all
+        if recent_versions:
+            query = {
+                'bool': {
+                    'must_not': [
+                        {'terms': {'version': sorted(recent_versions)}},
+                    ],
+                },
+            }
+        else:
+            query = {'match_all': {}}
+        hits = async_scan(
+            es,
+            index=index,
+            query={
+                # only ship the fields the loop below reads; the profiled
+                # metadata is much bigger than that
+                '_source': [
+                    'version', 'name', 'materialize', 'source',
+                    'description', 'date', 'manual_annotations',
+                ],
+                'query': query,
             },
-        },
-        size=SIZE,
-    )
-    reprocessed = 0
-    for h in hits:
-        obj = h['_source']
-        dataset_version = obj['version']
-        if is_version_more_recent(version, dataset_version):
-            logger.debug("%s is recent enough (version=%r)",
-                         h['_id'], dataset_version)
-            continue
-
-        reprocessed += 1
-        logger.info("Reprocessing %s, version=%r",
-                    h['_id'], dataset_version)
-        metadata = dict(name=obj['name'],
-                        materialize=obj['materialize'],
-                        source=obj.get('source', 'unknown'))
-        if obj.get('description'):
-            metadata['description'] = obj['description']
-        if obj.get('date'):
-            metadata['date'] = obj['date']
-        if obj.get('manual_annotations'):
-            metadata['manual_annotations'] = obj['manual_annotations']
-        await amqp_profile_exchange.publish(
-            json2msg(dict(id=h['_id'], metadata=metadata)),
-            '',
+            size=SIZE,
+            request_timeout=60,
         )
+        # overlap fetching and publishing: a producer task pulls scroll pages
+        # while this coroutine publishes the previous one
+        queue = asyncio.Queue(maxsize=2)
+        producer = asyncio.get_event_loop().create_task(
+            scan_pages(hits, queue),
+        )
+
+        reprocessed = 0
+        # don't build the format-args tuple 10k times a page if the records
+        # are going to be dropped anyway
+        log_info = logger.isEnabledFor(logging.INFO)
+        while True:
+            page = await queue.get()
+            if page is None:
+                break
+            # publishes are flushed in batches so the per-message broker
+            # round-trips overlap instead of being awaited one at a time
+            pending = []
+            for h in page:
+                obj = h['_source']
+                reprocessed += 1
+                if log_info:
+                    logger.info("Reprocessing %s, version=%r",
+                                h['_id'], obj['version'])
+                metadata = dict(name=obj['name'],
+                                materialize=obj['materialize'],
+                                source=obj.get('source', 'unknown'))
+                metadata.update(
+                    (key, obj[key])
+                    for key in OPTIONAL_METADATA_KEYS
+                    if obj.get(key)
+                )
+                # splice the body together instead of serializing an
+                # intermediate envelope dict per message
+                body = (
+                    b'{"id":' + dumps(h['_id']) +
+                    b',"metadata":' + dumps(metadata) +
+                    b'}'
+                )
+                exchange = amqp_exchanges[reprocessed % AMQP_CHANNELS]
+                pending.append(exchange.publish(
+                    aio_pika.Message(body, content_type='application/json'),
+                    '',
+                ))
+                if len(pending) >= PUBLISH_BATCH_SIZE:
+                    await asyncio.gather(*pending)
+                    pending.clear()
+            if pending:
+                await asyncio.gather(*pending)
+        await producer
+    finally:
+        # closing the connection tears down the channels and flushes
+        # whatever frames are still buffered on the socket -- with
+        # confirms off, nothing else guarantees the tail of the last
+        # batch went out
+        await amqp_conn.close()
     logger.info("Reprocessed %d datasets", reprocessed)
 
 
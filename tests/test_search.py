@@ -262,40 +262,40 @@ class TestAugmentation(DataTestCase):
         self.assertEqual(len(es.search.call_args_list), 1)
         args, kwargs = es.search.call_args_list[0]
         self.assertEqual(args, ())
-        temporal_query = lambda a, b: {
+        temporal_query = {
             'nested': {
                 'path': 'ranges',
                 'query': {
-                    'function_score': {
+                    'script_score': {
                         'query': {
-                            'range': {
-                                'ranges.range': {
-                                    'gte': a,
-                                    'lte': b,
-                                    'relation': 'intersects',
-                                },
+                            'bool': {
+                                'should': [
+                                    {
+                                        'range': {
+                                            'ranges.range': {
+                                                'gte': a,
+                                                'lte': b,
+                                                'relation': 'intersects',
+                                            },
+                                        },
+                                    }
+                                    for a, b in [(1.0, 2.0), (11.0, 12.0)]
+                                ],
+                                'minimum_should_match': 1,
                             },
                         },
-                        'script_score': {
-                            'script': {
-                                'lang': 'painless',
-                                'params': {
-                                    'gte': a,
-                                    'lte': b,
-                                    'coverage': 4.0,
-                                },
-                                'source': lambda s: (
-                                    isinstance(s, str) and len(s) > 20
-                                ),
+                        'script': {
+                            'id': 'datamart_coverage_temporal',
+                            'params': {
+                                'ranges': [[1.0, 2.0], [11.0, 12.0]],
+                                'coverage': 4.0,
                             },
                         },
-                        'boost_mode': 'replace',
                     },
                 },
                 'inner_hits': {
                     '_source': False,
                     'size': 100,
-                    'name': lambda s: s.startswith('range-'),
                 },
                 'score_mode': 'sum',
             },
@@ -313,8 +313,7 @@ class TestAugmentation(DataTestCase):
                                 'bool': {
                                     'filter': [],
                                     'should': [
-                                        temporal_query(1.0, 2.0),
-                                        temporal_query(11.0, 12.0),
+                                        temporal_query,
                                     ],
                                     'must_not': [],
                                     'minimum_should_match': 1